@@ -15,7 +15,7 @@
 # limitations under the License.
 #
 from __future__ import annotations
-from collections.abc import Generator, KeysView
+from collections.abc import Callable, Generator, KeysView
 from dataclasses import dataclass
 from urllib.parse import parse_qs
 from time import monotonic
@@ -25,51 +25,97 @@ import logging
 import asyncio
 import os
 
+try:
+    import httptools
+except ImportError:
+    httptools = None
+
+
+_KNOWN_HEADER_NAMES = (
+    'Accept', 'Accept-Charset', 'Accept-Encoding', 'Accept-Language', 'Accept-Ranges',
+    'Access-Control-Allow-Credentials', 'Access-Control-Allow-Headers', 'Access-Control-Allow-Methods',
+    'Access-Control-Allow-Origin', 'Access-Control-Expose-Headers', 'Access-Control-Max-Age',
+    'Access-Control-Request-Headers', 'Access-Control-Request-Method',
+    'Age', 'Allow', 'Authorization', 'Cache-Control', 'Connection',
+    'Content-Disposition', 'Content-Encoding', 'Content-Language', 'Content-Length',
+    'Content-Location', 'Content-Range', 'Content-Security-Policy', 'Content-Type',
+    'Cookie', 'Date', 'DNT', 'ETag', 'Expect', 'Expires', 'Forwarded', 'From', 'Host',
+    'If-Match', 'If-Modified-Since', 'If-None-Match', 'If-Range', 'If-Unmodified-Since',
+    'Keep-Alive', 'Last-Modified', 'Link', 'Location', 'Origin', 'Pragma',
+    'Proxy-Authenticate', 'Proxy-Authorization', 'Range', 'Referer', 'Retry-After',
+    'Sec-Fetch-Dest', 'Sec-Fetch-Mode', 'Sec-Fetch-Site', 'Sec-Fetch-User',
+    'Server', 'Set-Cookie', 'Strict-Transport-Security', 'TE', 'Trailer', 'Transfer-Encoding',
+    'Upgrade', 'Upgrade-Insecure-Requests', 'User-Agent', 'Vary', 'Via', 'Warning',
+    'WWW-Authenticate', 'X-Content-Type-Options', 'X-Forwarded-For', 'X-Forwarded-Host',
+    'X-Forwarded-Proto', 'X-Frame-Options', 'X-Real-IP', 'X-Request-ID', 'X-Requested-With',
+)
+
+# lowercase name of the well-known headers, in the common spellings,
+# to avoid a str.lower() call on every header operation
+_LOWER_HEADER_NAMES = {spelling: name.lower() for name in _KNOWN_HEADER_NAMES
+                       for spelling in (name, name.lower(), name.upper(), name.title())}
+
 
 class HttpHeaders:
     def __init__(self) -> None:
+        # most of the headers have a single value, which is stored as is.
+        # a list is used only when a key has multiple values
         self._headers = {}
 
     def set(self, key, value):
-        self._headers[key.lower()] = [value]
+        self._headers[_LOWER_HEADER_NAMES.get(key) or key.lower()] = value
         return self
 
     def add(self, key, value):
-        self._headers.setdefault(key.lower(), []).append(value)
+        key = _LOWER_HEADER_NAMES.get(key) or key.lower()
+        existing = self._headers.get(key)
+        if existing is None:
+            self._headers[key] = value
+        elif isinstance(existing, list):
+            existing.append(value)
+        else:
+            self._headers[key] = [existing, value]
         return self
 
     def get_list(self, key):
-        return self._headers.get(key.lower())
+        v = self._headers.get(_LOWER_HEADER_NAMES.get(key) or key.lower())
+        if v is None or isinstance(v, list):
+            return v
+        return [v]
 
     def get(self, key, default=None, transform=lambda x: x):
-        v = self.get_list(key)
-        return transform(v[0]) if v else default
+        v = self._headers.get(_LOWER_HEADER_NAMES.get(key) or key.lower())
+        if v is None:
+            return default
+        return transform(v[0] if isinstance(v, list) else v)
 
     def merge(self, other):
         if isinstance(other, HttpHeaders):
-            for k, l in other._headers.items():
-                self._headers.setdefault(k, []).extend(l)
-        else:
-            for k, v in other.items():
-                hlist = self._headers.setdefault(k, [])
-                if isinstance(v, list):
-                    hlist.extend(v)
-                else:
-                    hlist.append(v)
+            other = other._headers
+        for k, v in other.items():
+            if isinstance(v, list):
+                for item in v:
+                    self.add(k, item)
+            else:
+                self.add(k, v)
 
     def keys(self) -> KeysView:
         return self._headers.keys()
 
     def items(self) -> Generator[tuple[str, str]]:
-        for k, l in self._headers.items():
-            for v in l:
+        for k, v in self._headers.items():
+            if isinstance(v, list):
+                for item in v:
+                    yield k, item
+            else:
                 yield k, v
 
     def __len__(self) -> int:
-        return sum(len(l) for l in self._headers.values())
+        return sum(len(v) if isinstance(v, list) else 1 for v in self._headers.values())
 
     def __getitem__(self, key):
-        return self._headers[key.lower()]
+        v = self._headers[_LOWER_HEADER_NAMES.get(key) or key.lower()]
+        return v if isinstance(v, list) else [v]
 
     def __repr__(self) -> str:
         return repr(self._headers)
@@ -109,64 +155,176 @@ def _parse_path(path):
         return path, {}
     return path[:index], parse_qs(path[index+1:])
 
-async def http_parser(reader: asyncio.StreamReader, timeout: float, http_trace: bool = True) -> HttpRequest:
-    line = await asyncio.wait_for(reader.readuntil(b'\r\n'), timeout)
-    if not line:
-        return None
+# the same str object is returned for the common methods and versions,
+# instead of allocating a new one for every request
+_HTTP_METHODS = {m.encode(): m for m in ('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'CONNECT', 'OPTIONS', 'TRACE', 'PATCH')}
+_HTTP_VERSIONS = {v.encode(): v for v in ('HTTP/1.0', 'HTTP/1.1')}
+_HTTPTOOLS_VERSIONS = {'1.0': 'HTTP/1.0', '1.1': 'HTTP/1.1'}
 
-    words = line.decode().split()
+def _parse_http_head(block: bytes) -> tuple[str, str, str, HttpHeaders]:
+    # the block ends with \r\n\r\n, so the last two lines are empty
+    lines = block.split(b'\r\n')
+    words = lines[0].split()
 
-    method, path, version = (words[0], words[1], words[2])
-    path = _clean_path(path)
-    path, query_params = _parse_path(path)
+    method = _HTTP_METHODS.get(words[0]) or words[0].decode()
+    path = words[1].decode()
+    version = _HTTP_VERSIONS.get(words[2]) or words[2].decode()
 
     headers = HttpHeaders()
-    while True:
-        line = await asyncio.wait_for(reader.readuntil(b'\r\n'), timeout)
-        if not line or line == b'\r\n':
-            break
+    for line in lines[1:-2]:
+        index = line.find(b':')
+        if index < 0:
+            raise ValueError(f'invalid http header line: {line}')
+        headers.add(line[:index].strip().decode(), line[index + 1:].strip().decode())
+    return method, path, version, headers
 
-        key, value = line.decode().split(': ', 1)
-        headers.add(key.strip(), value.strip())
+
+class _HttpToolsHead:
+    def __init__(self) -> None:
+        self.url = b''
+        self.headers = HttpHeaders()
+
+    def on_url(self, url: bytes):
+        self.url += url
+
+    def on_header(self, name: bytes, value: bytes):
+        self.headers.add(name.decode(), value.strip().decode())
+
+
+def _parse_http_head_httptools(block: bytes) -> tuple[str, str, str, HttpHeaders]:
+    head = _HttpToolsHead()
+    parser = httptools.HttpRequestParser(head)
+    try:
+        # only the head is fed, the body is read separately using the content-length
+        parser.feed_data(block)
+    except httptools.HttpParserUpgrade:
+        pass
+    method = parser.get_method()
+    method = _HTTP_METHODS.get(method) or method.decode()
+    version = parser.get_http_version()
+    version = _HTTPTOOLS_VERSIONS.get(version) or 'HTTP/' + version
+    return method, head.url.decode(), version, head.headers
+
+
+class HttpIdleTimeoutError(asyncio.TimeoutError):
+    """
+    Raised by the http parsers when no request head is received within the timeout.
+    The buffered data is not consumed, so the read can be retried.
+    """
+
+
+async def _read_http_request(reader: asyncio.StreamReader, timeout: float, http_trace: bool,
+                             parse_head: Callable[[bytes], tuple[str, str, str, HttpHeaders]]) -> HttpRequest:
+    # read the request line and the headers at once.
+    # the size of the block is bounded by the reader limit (LimitOverrunError)
+    try:
+        block = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+    except asyncio.TimeoutError as e:
+        raise HttpIdleTimeoutError() from e
+    if not block:
+        return None
+
+    # the body timeout starts once the head is received,
+    # so the idle time of a keep-alive connection is not counted
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    method, path, version, headers = parse_head(block)
+    path = _clean_path(path)
+    path, query_params = _parse_path(path)
 
     content_length = headers.get('content-length', -1, int)
 
     if content_length > 0:
-        body = await asyncio.wait_for(reader.readexactly(content_length), timeout)
+        if len(reader._buffer) >= content_length:
+            # the body is already buffered, readexactly() will not block
+            # so we can avoid the task created by wait_for()
+            body = await reader.readexactly(content_length)
+        else:
+            body = await asyncio.wait_for(reader.readexactly(content_length), deadline - loop.time())
     else:
         body = None
 
     request = HttpRequest(monotonic(), method, path, query_params, version, headers, body)
-    if http_trace:
+    if http_trace and http_logger.isEnabledFor(logging.DEBUG):
         dump_http_request(request)
     return request
 
+async def http_parser(reader: asyncio.StreamReader, timeout: float, http_trace: bool = True) -> HttpRequest:
+    return await _read_http_request(reader, timeout, http_trace, _parse_http_head)
 
-async def http_send_response(writer: asyncio.StreamWriter, request: HttpRequest, response: HttpResponse, http_trace: bool = True) -> HttpRequest:
-    http_status = HTTPStatus(response.status_code)
-    headers = response.headers if response.headers else HttpHeaders()
+async def http_parser_httptools(reader: asyncio.StreamReader, timeout: float, http_trace: bool = True) -> HttpRequest:
+    if httptools is None:
+        raise RuntimeError('httptools is not installed')
+    return await _read_http_request(reader, timeout, http_trace, _parse_http_head_httptools)
 
-    content_length = 0
-    if response.body:
-        content_length = len(response.body)
-    elif response.file_path:
-        content_length = os.stat(response.file_path).st_size
-    headers.set('content-length', content_length)
+# the httptools (C) parser is used when installed, the pure python one is the fallback
+http_default_parser = http_parser_httptools if httptools is not None else http_parser
+
+
+_STATUS_LINES = {status.value: f'HTTP/1.1 {status.value} {status.phrase}\r\n'.encode('utf-8') for status in HTTPStatus}
+
+class HttpResponseNotSentError(Exception):
+    """
+    Raised by http_send_response() when the response cannot be prepared
+    (e.g. the file to send does not exist). Nothing was written to the client.
+    """
 
-    if http_trace:
+
+async def http_send_response(writer: asyncio.StreamWriter, request: HttpRequest, response: HttpResponse,
+                             http_trace: bool = True, extra_headers_block: bytes = b'') -> HttpRequest:
+    fd = None
+    try:
+        if not response.body and response.file_path:
+            # the file is opened first, so the size is taken with fstat() from the same fd used by sendfile
+            fd = open(response.file_path, 'rb')
+            content_length = os.fstat(fd.fileno()).st_size
+        else:
+            content_length = len(response.body) if response.body else 0
+        head = _build_response_head(request, response, content_length, http_trace, extra_headers_block)
+    except Exception as e:
+        if fd is not None:
+            fd.close()
+        raise HttpResponseNotSentError(f'unable to prepare the response: {e}') from e
+
+    if fd is None:
+        writer.write(head)
+    else:
+        with fd:
+            writer.write(head)
+            # loop.sendfile() waits for the head to be flushed, then uses the zero-copy
+            # os.sendfile() on plain sockets, falling back to read/write (e.g. for SSL)
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.sendfile(writer.transport, fd, 0, content_length, fallback=True)
+            except NotImplementedError:
+                # some event loops (e.g. uvloop) do not implement sendfile()
+                while True:
+                    chunk = await loop.run_in_executor(None, fd.read, 65536)
+                    if not chunk:
+                        break
+                    writer.write(chunk)
+                    await writer.drain()
+    await writer.drain()
+
+def _build_response_head(request: HttpRequest, response: HttpResponse, content_length: int,
+                         http_trace: bool, extra_headers_block: bytes) -> bytes:
+    if http_trace and http_logger.isEnabledFor(logging.DEBUG):
         dump_http_response(request, response)
 
-    writer.write(f'HTTP/1.1 {http_status.value} {http_status.phrase}\r\n'.encode('utf-8'))
-    for key, value in headers.items():
-        writer.write(f'{key}: {value}\r\n'.encode('utf-8'))
-    writer.write(b'\r\n')
+    # status line, headers and body (if any) are sent with a single write
+    status_line = _STATUS_LINES.get(response.status_code)
+    if status_line is None:
+        status_line = f'HTTP/1.1 {response.status_code} \r\n'.encode('utf-8')
+    parts = [status_line, b'content-length: %d\r\n' % content_length]
+    if response.headers:
+        parts.extend(f'{key}: {value}\r\n'.encode('utf-8')
+                     for key, value in response.headers.items() if key != 'content-length')
+    parts.append(extra_headers_block)
+    parts.append(b'\r\n')
     if response.body:
-        writer.write(response.body)
-    elif response.file_path:
-        await writer.drain()
-        with open(response.file_path, 'rb') as fd:
-            await asyncio.get_event_loop().sendfile(writer.transport, fd, 0, fallback=True)
-    await writer.drain()
+        parts.append(response.body)
+    return b''.join(parts)
 
 http_logger = logging.getLogger('http_trace')
 
@@ -182,10 +340,11 @@ def _dump_http_body(tag: str, headers: HttpHeaders, body: bytes | None):
 
 def dump_http_request(request: HttpRequest):
     http_logger.debug('REQ: %s %s', request.method, request.path)
-    http_logger.debug('REQ-HEADERS: %s', dict(request.headers.items()))
+    http_logger.debug('REQ-HEADERS: %s', request.headers)
     _dump_http_body('REQ-BODY', request.headers, request.body)
 
 def dump_http_response(request: HttpRequest, response: HttpResponse):
     http_logger.debug('RESP: %s %s %s execTime:%s', response.status_code, request.method, request.path, monotonic() - request.stamp)
-    http_logger.debug('RESP-HEADERS: %s', dict(response.headers.items()))
-    _dump_http_body('RESP-BODY', response.headers, response.body)
+    headers = response.headers if response.headers else HttpHeaders()
+    http_logger.debug('RESP-HEADERS: %s', headers)
+    _dump_http_body('RESP-BODY', headers, response.body)
@@ -15,8 +15,9 @@
 # limitations under the License.
 #
 from __future__ import annotations
-from collections.abc import Generator
-from dataclasses import dataclass
+from collections.abc import Awaitable, Callable, Generator
+from collections import deque
+from dataclasses import dataclass, field
 from inspect import getfullargspec
 import logging
 import asyncio
@@ -24,10 +25,30 @@ import types
 import json
 import re
 
-from .http_util import HttpRequest, HttpResponse, HttpHeaders, http_parser, http_send_response
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> bytes:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson does not support everything json does (e.g. namedtuples, big ints)
+            return json.dumps(obj).encode('utf-8')
+except ImportError:
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+from .http_util import HttpRequest, HttpResponse, HttpHeaders, HttpIdleTimeoutError, HttpResponseNotSentError
+from .http_util import http_default_parser, http_send_response
 
 logger = logging.getLogger('asyncio_simple_http_server')
 
+_SAFE_HTTP_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'TRACE'))
+
 
 @dataclass
 class UriRoute:
@@ -35,6 +56,7 @@ class UriRoute:
     http_method: str | list[str]
     uri_variables: list[str] | None
     call_args: list[str]
+    binders: list[Callable[[HttpRequest, dict | None], object]] = field(default_factory=list, repr=False)
 
     def is_static(self) -> bool:
         return not isinstance(self.path, re.Pattern)
@@ -59,29 +81,27 @@ class UriRoute:
         return self.path.match(path) is not None
 
 
-def _convert_params(request: HttpRequest, route: UriRoute, method):
+_PARAM_BINDERS = {
+    'request': lambda request, uri_variables: request,
+    'raw_body': lambda request, uri_variables: request.body,
+    'body': lambda request, uri_variables: _json_loads(request.body),
+    'query_params': lambda request, uri_variables: request.query_params,
+    'headers': lambda request, uri_variables: request.headers,
+    'uri_variables': lambda request, uri_variables: uri_variables if uri_variables is not None else {},
+}
+
+def _param_binder(param_name: str) -> Callable[[HttpRequest, dict | None], object]:
+    return _PARAM_BINDERS.get(param_name, lambda request, uri_variables: None)
+
+
+def _method_binders(route: UriRoute, method) -> list[Callable[[HttpRequest, dict | None], object]]:
     args_index = 0 if isinstance(method, types.FunctionType) else 1  # skip 'self'
-    args = []
-    for param_name in route.call_args[args_index:]:
-        if param_name == 'request':
-            args.append(request)
-        elif param_name == 'raw_body':
-            args.append(request.body)
-        elif param_name == 'body':
-            args.append(json.loads(request.body))
-        elif param_name == 'query_params':
-            args.append(request.query_params)
-        elif param_name == 'headers':
-            args.append(request.headers)
-        elif param_name == 'uri_variables':
-            if len(route.uri_variables) == 1:
-                uri_variables = dict(zip(route.uri_variables, re.findall(route.path, request.path)))
-            else:
-                uri_variables = dict(zip(route.uri_variables, re.findall(route.path, request.path)[0]))
-            args.append(uri_variables)
-        else:
-            args.append(None)
-    return args
+    return route.binders[args_index:]
+
+
+def _convert_params(request: HttpRequest, binders: list[Callable[[HttpRequest, dict | None], object]],
+                    uri_variables: dict[str, str] | None):
+    return [binder(request, uri_variables) for binder in binders]
 
 
 def _uri_variable_to_pattern(uri):
@@ -111,17 +131,111 @@ def _uri_route_decorator(f, path: str | re.Pattern, http_method: str | list[str]
                          uri_variables: list[str] | None = None):
     args_specs = getfullargspec(f)
     route = UriRoute(path, http_method, uri_variables, args_specs.args)
+    route.binders = [_param_binder(param_name) for param_name in route.call_args]
 
     routes = getattr(f, '_http_routes', [])
     routes.append(route)
     f._http_routes = routes
     return f
 
+_REGEX_SPECIAL_CHARS = frozenset('\\.^$*+?{}[]|()')
+
+def _route_static_path(route: UriRoute) -> str | None:
+    """
+    Returns the path to use as static route key, if the route can be matched
+    with a plain string compare: static routes and literal patterns like ^/foo$.
+    Patterns without the trailing $ are prefix matches, and are left as regex.
+    """
+    if route.is_static():
+        return route.path
+
+    if route.path.flags != re.UNICODE:
+        return None
+
+    pattern = route.path.pattern
+    if not pattern.endswith('$'):
+        return None
+    pattern = pattern[1:-1] if pattern.startswith('^') else pattern[:-1]
+    return pattern if _REGEX_SPECIAL_CHARS.isdisjoint(pattern) else None
+
+_ROUTE_GROUP_NAME_REGEX = re.compile(r'\(\?P([<=])(?=\w)')
+
+# numbered backrefs and conditionals refer to the group numbers, which are shifted
+# once the pattern is wrapped in the combined one. global flags cannot be combined.
+_UNCOMBINABLE_PATTERN_REGEX = re.compile(r'\\[1-9]|\(\?\(|\(\?[aiLmsux]+\)')
+
+def _is_combinable_route(route: UriRoute) -> bool:
+    return route.path.flags == re.UNICODE and not _UNCOMBINABLE_PATTERN_REGEX.search(route.path.pattern)
+
+def _combine_regex_routes(regex_routes: list[tuple[UriRoute, object, list]]):
+    """
+    Combines the regex routes into a single pattern like (?P<r0>...)|(?P<r1>...)
+    so that a single match() finds the first route matching the path.
+    The named groups of each route are prefixed (r0_name) to avoid redefinitions.
+    Returns the compiled pattern and a map of the outer group index to the route
+    and to the (uri variable, group index) of its named groups.
+    """
+    patterns = []
+    for index, (route, _, _) in enumerate(regex_routes):
+        group_name = f'r{index}'
+        pattern = _ROUTE_GROUP_NAME_REGEX.sub(lambda m: f'(?P{m.group(1)}{group_name}_', route.path.pattern)
+        patterns.append(f'(?P<{group_name}>{pattern})')
+    regex = re.compile('|'.join(patterns))
+
+    routes = {}
+    for index, mapping in enumerate(regex_routes):
+        group_name = f'r{index}'
+        uri_groups = [(name, regex.groupindex[f'{group_name}_{name}']) for name in mapping[0].path.groupindex]
+        routes[regex.groupindex[group_name]] = (mapping, uri_groups)
+    return regex, routes
+
+def _build_regex_dispatch(regex_routes: list[tuple[UriRoute, object, list]]):
+    """
+    Returns the list of (regex, combined routes, route mapping) to try in order.
+    Consecutive routes are combined in a single pattern, while the routes that
+    cannot be combined (e.g. using numbered backrefs) are matched on their own.
+    """
+    dispatch = []
+    combinable = []
+
+    def add_combined():
+        if not combinable:
+            return
+        try:
+            regex, routes = _combine_regex_routes(combinable)
+            dispatch.append((regex, routes, None))
+        except re.error:
+            dispatch.extend((mapping[0].path, None, mapping) for mapping in combinable)
+        combinable.clear()
+
+    for mapping in regex_routes:
+        if _is_combinable_route(mapping[0]):
+            combinable.append(mapping)
+        else:
+            add_combined()
+            dispatch.append((mapping[0].path, None, mapping))
+    add_combined()
+    return dispatch
+
 def _scan_handler_for_uri_routes(handler: object) -> Generator[tuple[object, UriRoute]]:
-    for attr in dir(handler):
-        method = getattr(handler, attr)
-        for route in getattr(method, '_http_routes', []):
-            yield method, route
+    # walk the instance and class dicts instead of dir() to avoid resolving every attribute.
+    # names already seen (instance or subclass) are skipped to respect the overrides
+    namespaces = [getattr(handler, '__dict__', {})]
+    namespaces.extend(vars(klass) for klass in type(handler).__mro__)
+
+    seen = set()
+    for namespace in namespaces:
+        for attr, value in namespace.items():
+            if attr in seen:
+                continue
+            seen.add(attr)
+
+            # staticmethod and classmethod keep the decorated function in __func__
+            routes = getattr(getattr(value, '__func__', value), '_http_routes', None)
+            if routes:
+                method = getattr(handler, attr)
+                for route in routes:
+                    yield method, route
 
 def uri_mapping(path: str, method: str | list[str] = 'GET'):
     return lambda f: _uri_route_decorator(f, path, method)
@@ -142,15 +256,55 @@ class HttpResponseException(Exception):
         super().__init__()
         self.response = HttpResponse(status_code, headers, body)
 
+class _BufferedStreamReaderProtocol(asyncio.StreamReaderProtocol, asyncio.BufferedProtocol):
+    """
+    StreamReaderProtocol receiving the data through the BufferedProtocol interface.
+    The transport reads into a preallocated buffer and the data is appended from there
+    to the StreamReader buffer, without allocating a new bytes object for every chunk.
+    """
+    def __init__(self, stream_reader: asyncio.StreamReader, client_connected_cb, buffer_size: int = 65536) -> None:
+        super().__init__(stream_reader, client_connected_cb)
+        self._recv_buffer = memoryview(bytearray(buffer_size))
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self._recv_buffer
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.data_received(self._recv_buffer[:nbytes])
+
+
+def _install_uvloop():
+    try:
+        import uvloop
+    except ImportError:
+        logger.warning('uvloop is not installed, using the default asyncio event loop')
+        return
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    try:
+        asyncio.get_running_loop()
+        logger.warning('uvloop installed while an event loop is running, only the loops created later will use it')
+    except RuntimeError:
+        pass
+
+
 class HttpServer:
-    def __init__(self) -> None:
+    def __init__(self, use_uvloop: bool = False) -> None:
+        if use_uvloop:
+            _install_uvloop()
+
         self.read_timeout = 10.0
+        self.max_pipelined_requests = 16
         self.trace_client_disconnection = False
         self._default_response_headers = HttpHeaders()
+        self._default_response_headers_block = b''
+        self._http_404_response = HttpResponse(404)
         self._static_routes = {}
-        self._regex_routes = []
+        self._regex_routes = {}
+        self._regex_dispatch = {}
         self._server = None
         self._debug_http = True
+        self._http_parser = http_default_parser
 
     async def __aenter__(self):
         pass
@@ -163,23 +317,38 @@ class HttpServer:
 
     def add_default_response_headers(self, headers: HttpHeaders):
         self._default_response_headers.merge(headers)
+        # serialize the default headers once, they are appended as is to every response
+        self._default_response_headers_block = b''.join(
+            f'{key}: {value}\r\n'.encode('utf-8') for key, value in self._default_response_headers.items())
 
     def add_handler(self, handler):
         logger.debug('Register handler %s', handler)
         for method, route in _scan_handler_for_uri_routes(handler):
-            if route.is_static():
-                for http_method in route.http_methods():
-                    self._static_routes[f'{http_method}:{route.path}'] = (route, method)
-                    logger.debug('Register static route %s %s to %s', http_method, route.path, method)
-            else:
-                self._regex_routes.append((route, method))
-                logger.debug('Register regex route %s %s to %s', route.http_method, route.path, method)
+            binders = _method_binders(route, method)
+            static_path = _route_static_path(route)
+            for http_method in route.http_methods():
+                regex_routes = self._regex_routes.get(http_method, ())
+                # a literal pattern is kept as regex if a regex route registered before matches it
+                if static_path is not None and (route.is_static() or
+                                                not any(r.path.match(static_path) for r, _, _ in regex_routes)):
+                    self._static_routes.setdefault(http_method, {})[static_path] = (route, method, binders)
+                    logger.debug('Register static route %s %s to %s', http_method, static_path, method)
+                else:
+                    self._regex_routes.setdefault(http_method, []).append((route, method, binders))
+                    logger.debug('Register regex route %s %s to %s', http_method, route.path, method)
+
+        for http_method, regex_routes in self._regex_routes.items():
+            self._regex_dispatch[http_method] = _build_regex_dispatch(regex_routes)
 
     async def start(self, host, port):
         if self._server is not None:
             raise RuntimeError('Server already started')
 
-        self._server = await asyncio.start_server(self._handle_client, host, port)
+        def protocol_factory():
+            return _BufferedStreamReaderProtocol(asyncio.StreamReader(), self._handle_client)
+
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(protocol_factory, host, port)
 
     async def close(self):
         if self._server is not None:
@@ -200,21 +369,37 @@ class HttpServer:
         return ', '.join(str(sock.getsockname()) for sock in self._server.sockets)
 
     async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # pipelined requests with safe methods are executed concurrently, while the reader keeps parsing.
+        # a non-safe request (e.g. POST) waits for the previous ones to complete before being executed,
+        # and the requests after it wait for its execution (RFC 9112 Section 9.3.2).
+        # each response waits for the previous one to be sent, to keep the requests order.
+        pending = deque()
+        barrier = None
         try:
             while True:
-                request = await http_parser(reader, self.read_timeout, self._debug_http)
+                try:
+                    request = await self._http_parser(reader, self.read_timeout, self._debug_http)
+                except HttpIdleTimeoutError:
+                    if not pending or pending[-1].done():
+                        raise
+                    # the connection is not idle while requests are in flight,
+                    # wait for them and then start again the read timeout
+                    await pending[-1]
+                    continue
                 if request is None:
                     break
                 logger.debug('received request %s %s', request.method, request.path)
 
-                route, method = self._find_route(request)
-                if method:
-                    logger.debug('found matching route %s calling method %s', route, method)
-                    await self._process_request(writer, route, method, request)
+                previous = pending[-1] if pending else None
+                if request.method in _SAFE_HTTP_METHODS:
+                    execution = self._execute_request_after(request, barrier)
                 else:
-                    logger.warning('unable to find any matching route for %s %s', request.method, request.path)
-                    response = self.build_http_404_response(request.method, request.path)
-                    await self._send_response(writer, request, response)
+                    execution = barrier = asyncio.ensure_future(self._execute_request_after(request, previous))
+                pending.append(asyncio.ensure_future(self._process_request(writer, request, execution, previous)))
+                while pending and pending[0].done():
+                    pending.popleft().result()
+                if len(pending) >= self.max_pipelined_requests:
+                    await pending.popleft()
 
         except (TimeoutError, asyncio.TimeoutError, asyncio.exceptions.IncompleteReadError) as e:
             if self.trace_client_disconnection:
@@ -222,50 +407,81 @@ class HttpServer:
         except Exception as e:
             logger.exception('got a failure %s. disconnecting the client: %s', type(e), e)
         finally:
+            # send the responses of the requests already received before closing
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, Exception):
+                    logger.error('got a failure %s sending the response. disconnecting the client: %s',
+                                 type(result), result, exc_info=result)
+                    break
             writer.close()
 
     def build_http_404_response(self, _method: str, _path: str) -> HttpResponse:
-        return HttpResponse(404)
+        return self._http_404_response
 
     def build_http_500_response(self, _exception: Exception) -> HttpResponse:
         return HttpResponse(500)
 
-    async def _process_request(self, writer, route, method, request: HttpRequest):
+    async def _process_request(self, writer, request: HttpRequest, execution: Awaitable[HttpResponse],
+                               previous: asyncio.Future | None):
+        response = await execution
+        if previous is not None:
+            await previous
+        try:
+            await self._send_response(writer, request, response)
+        except HttpResponseNotSentError as e:
+            logger.exception('got a %s failure sending the response of the request %s %s',
+                             type(e.__cause__), request.method, request.path)
+            await self._send_response(writer, request, self.build_http_500_response(e.__cause__))
+
+    async def _execute_request_after(self, request: HttpRequest, previous: asyncio.Future | None) -> HttpResponse:
+        if previous is not None:
+            await previous
+        return await self._execute_request(request)
+
+    async def _execute_request(self, request: HttpRequest) -> HttpResponse:
+        mapping, uri_variables = self._find_route(request)
+        if not mapping:
+            logger.warning('unable to find any matching route for %s %s', request.method, request.path)
+            return self.build_http_404_response(request.method, request.path)
+
+        route, method, binders = mapping
+        logger.debug('found matching route %s calling method %s', route, method)
         try:
-            args = _convert_params(request, route, method)
+            args = _convert_params(request, binders, uri_variables)
             response = method(*args)
             if asyncio.iscoroutine(response):
                 response = await response
 
             if not isinstance(response, HttpResponse):
                 if response is None:
-                    response = HttpResponse(204)
-                else:
-                    # TODO: by default we convert to json
-                    body = json.dumps(response).encode('utf-8')
-                    response = HttpResponse(200, None, body)
-            await self._send_response(writer, request, response)
+                    return HttpResponse(204)
+                # TODO: by default we convert to json
+                body = _json_dumps(response)
+                return HttpResponse(200, None, body)
+            return response
         except HttpResponseException as e:
-            await self._send_response(writer, request, e.response)
+            return e.response
         except Exception as e:
             logger.exception('got a %s failure during the execution of the request %s %s',
                              type(e), request.method, request.path)
-            response = self.build_http_500_response(e)
-            await self._send_response(writer, request, response)
+            return self.build_http_500_response(e)
 
     async def _send_response(self, writer, request: HttpRequest, response: HttpResponse):
-        if response.headers:
-            response.headers.merge(self._default_response_headers)
-        else:
-            response.headers = self._default_response_headers
-        await http_send_response(writer, request, response, self._debug_http)
+        await http_send_response(writer, request, response, self._debug_http, self._default_response_headers_block)
 
     def _find_route(self, request: HttpRequest):
-        mapping = self._static_routes.get(f'{request.method}:{request.path}')
-        if mapping:
-            return mapping
-
-        for route, method in self._regex_routes:
-            if route.match(request.method, request.path):
-                return route, method
+        static_routes = self._static_routes.get(request.method)
+        if static_routes:
+            mapping = static_routes.get(request.path)
+            if mapping:
+                return mapping, None
+
+        for regex, routes, mapping in self._regex_dispatch.get(request.method, ()):
+            m = regex.match(request.path)
+            if m:
+                if routes is None:
+                    return mapping, m.groupdict()
+                # reuse the combined match to extract the uri variables
+                mapping, uri_groups = routes[m.lastindex]
+                return mapping, {name: m.group(index) for name, index in uri_groups}
         return None, None
@@ -20,30 +20,60 @@ from asyncio import StreamReader
 import unittest
 import asyncio
 
-from asyncio_simple_http_server.http_util import http_parser
+from asyncio_simple_http_server.http_util import HttpRequest, HttpResponse, HttpHeaders
+from asyncio_simple_http_server.http_util import http_parser, http_parser_httptools, http_send_response
+from asyncio_simple_http_server.http_util import httptools
+
+
+class BufferWriter:
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+
+    def write(self, data: bytes):
+        self.buffer.extend(data)
+
+    async def drain(self):
+        pass
 
 
 class TestHttpUtils(unittest.IsolatedAsyncioTestCase):
     async def test_http_parse(self):
+        await self._assert_http_parse(http_parser)
+
+    @unittest.skipIf(httptools is None, 'httptools is not installed')
+    async def test_http_parse_httptools(self):
+        await self._assert_http_parse(http_parser_httptools)
+
+    async def _assert_http_parse(self, parser):
         reader = StreamReader()
         reader.feed_data(b'GET /foo HTTP/1.1\r\n\r\n')
         reader.feed_eof()
-        request = await http_parser(reader, 10)
+        request = await parser(reader, 10)
         self.assertEqual('GET', request.method)
         self.assertEqual('/foo', request.path)
+        self.assertEqual('HTTP/1.1', request.version)
         self.assertEqual(0, len(request.headers))
         self.assertEqual(None, request.body)
 
         reader = StreamReader()
         reader.feed_data(b'POST /foo HTTP/1.1\r\nContent-Length: 3\r\nX-Foo: 10\r\n\r\nabc')
         reader.feed_eof()
-        request = await http_parser(reader, 10)
+        request = await parser(reader, 10)
         self.assertEqual('POST', request.method)
         self.assertEqual('/foo', request.path)
         self.assertEqual(2, len(request.headers))
         self.assertEqual({'content-length', 'x-foo'}, request.headers.keys())
         self.assertEqual(b'abc', request.body)
 
+        reader = StreamReader()
+        reader.feed_data(b'GET /foo?a=1&a=2 HTTP/1.1\r\nHost: localhost:8080\r\nX-Foo:bar \r\nx-foo: baz\r\n\r\n')
+        reader.feed_eof()
+        request = await parser(reader, 10)
+        self.assertEqual('/foo', request.path)
+        self.assertEqual({'a': ['1', '2']}, request.query_params)
+        self.assertEqual('localhost:8080', request.headers.get('host'))
+        self.assertEqual(['bar', 'baz'], request.headers.get_list('x-foo'))
+
     async def test_http_parser_timeout(self):
         reader = StreamReader()
         reader.feed_data(b'GET /foo ')
@@ -56,6 +86,61 @@ class TestHttpUtils(unittest.IsolatedAsyncioTestCase):
             # Python 3.10 TimeoutError is different from TimeoutError in 3.11
             self.assertIsInstance(e, asyncio.exceptions.TimeoutError)
 
+        reader = StreamReader()
+        reader.feed_data(b'POST /foo HTTP/1.1\r\nContent-Length: 3\r\n\r\nab')
+        try:
+            await http_parser(reader, 1)
+            self.fail('expected timeout error')
+        except TimeoutError as e:
+            self.assertIsInstance(e, TimeoutError)
+        except asyncio.exceptions.TimeoutError as e:
+            self.assertIsInstance(e, asyncio.exceptions.TimeoutError)
+
+    async def test_http_parser_body_timeout_after_head(self):
+        loop = asyncio.get_running_loop()
+        reader = StreamReader()
+        # the idle time before the head and the body time are each below the timeout
+        loop.call_later(0.6, reader.feed_data, b'POST /foo HTTP/1.1\r\nContent-Length: 3\r\n\r\n')
+        loop.call_later(1.2, reader.feed_data, b'abc')
+        request = await http_parser(reader, 1)
+        self.assertEqual(b'abc', request.body)
+
+    def test_http_headers(self):
+        headers = HttpHeaders()
+        headers.set('X-Foo', 'a')
+        headers.add('X-Bar', 'b')
+        headers.add('x-bar', 'c')
+        self.assertEqual(3, len(headers))
+        self.assertEqual('a', headers.get('x-foo'))
+        self.assertEqual('b', headers.get('X-BAR'))
+        self.assertEqual(['a'], headers.get_list('x-foo'))
+        self.assertEqual(['b', 'c'], headers['x-bar'])
+        self.assertEqual(None, headers.get_list('x-baz'))
+        self.assertEqual(10, headers.get('x-baz', 10, int))
+        self.assertEqual([('x-foo', 'a'), ('x-bar', 'b'), ('x-bar', 'c')], list(headers.items()))
+
+        headers.merge({'X-Foo': ['d', 'e'], 'X-Baz': '1'})
+        self.assertEqual(['a', 'd', 'e'], headers.get_list('x-foo'))
+        self.assertEqual(1, headers.get('x-baz', transform=int))
+
+    async def test_http_send_response(self):
+        request = HttpRequest(0, 'GET', '/foo', {}, 'HTTP/1.1', HttpHeaders())
+
+        writer = BufferWriter()
+        await http_send_response(writer, request, HttpResponse(404))
+        self.assertEqual(b'HTTP/1.1 404 Not Found\r\ncontent-length: 0\r\n\r\n', bytes(writer.buffer))
+
+        writer = BufferWriter()
+        headers = HttpHeaders().set('X-Foo', 'bar')
+        await http_send_response(writer, request, HttpResponse(200, headers, b'abc'), extra_headers_block=b'x-dflt: 1\r\n')
+        self.assertEqual(b'HTTP/1.1 200 OK\r\ncontent-length: 3\r\nx-foo: bar\r\nx-dflt: 1\r\n\r\nabc', bytes(writer.buffer))
+
+        writer = BufferWriter()
+        response = HttpResponse(200, body=bytearray(b'abc'))
+        response.body.extend(b'def')
+        await http_send_response(writer, request, response)
+        self.assertEqual(b'HTTP/1.1 200 OK\r\ncontent-length: 6\r\n\r\nabcdef', bytes(writer.buffer))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
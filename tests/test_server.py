@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import namedtuple
+import importlib.util
+import unittest
+import asyncio
+
+from asyncio_simple_http_server import HttpServer, HttpRequest, HttpResponse, HttpHeaders
+from asyncio_simple_http_server import uri_mapping, uri_variable_mapping, uri_pattern_mapping
+from asyncio_simple_http_server.server import _convert_params
+
+
+class RoutesHandler:
+    @uri_mapping('/static', method=('GET', 'POST'))
+    def static(self):
+        pass
+
+    @uri_mapping('/body', method='POST')
+    def body(self, raw_body, body, query_params):
+        return body
+
+    @uri_variable_mapping('/aaa/{bbb}')
+    def one_variable(self, uri_variables):
+        return uri_variables
+
+    @uri_variable_mapping('/aaa/{bbb}/ccc/{ddd}', method=('GET', 'PUT'))
+    def two_variables(self, uri_variables):
+        return uri_variables
+
+    @uri_pattern_mapping('/any/(.*)')
+    def any_pattern(self):
+        pass
+
+    @uri_pattern_mapping('/any/shadowed$')
+    def shadowed_pattern(self):
+        pass
+
+    @uri_pattern_mapping('/literal-pattern')
+    def literal_pattern(self):
+        pass
+
+    @uri_pattern_mapping('^/anchored-pattern$')
+    def anchored_pattern(self):
+        pass
+
+    @uri_variable_mapping('/literal-variable')
+    def literal_variable(self, uri_variables):
+        return uri_variables
+
+
+class DescriptorsHandler:
+    @staticmethod
+    @uri_mapping('/static-method')
+    def static_method(headers):
+        return headers
+
+    @classmethod
+    @uri_mapping('/class-method')
+    def class_method(cls, headers):
+        return headers
+
+
+class UncombinableRoutesHandler:
+    @uri_pattern_mapping(r'/dup/(\w+)/\1')
+    def backref(self):
+        pass
+
+    @uri_pattern_mapping(r'(?i)/foo/.*')
+    def global_flags(self):
+        pass
+
+    @uri_variable_mapping('/foo/{bar}')
+    def variable(self, uri_variables):
+        return uri_variables
+
+    @uri_pattern_mapping(r'/a(x)?(?(1)y|z)$')
+    def conditional(self):
+        pass
+
+    @uri_pattern_mapping(r'/named/(?P<x>a)?(?(x)b|c)$')
+    def named_conditional(self, uri_variables):
+        return uri_variables
+
+
+class OverridingHandler(RoutesHandler):
+    @uri_mapping('/static-override')
+    def static(self):
+        pass
+
+    def any_pattern(self):
+        pass
+
+
+def _request(method: str, path: str) -> HttpRequest:
+    return HttpRequest(0, method, path, {}, 'HTTP/1.1', HttpHeaders())
+
+
+def _find_method(server: HttpServer, method: str, path: str):
+    mapping, _ = server._find_route(_request(method, path))
+    return mapping[1] if mapping else None
+
+
+class TestHttpServer(unittest.TestCase):
+    def test_find_route(self):
+        handler = RoutesHandler()
+        server = HttpServer()
+        server.add_handler(handler)
+
+        self.assertEqual(handler.static, _find_method(server, 'GET', '/static'))
+        self.assertEqual(handler.static, _find_method(server, 'POST', '/static'))
+        self.assertEqual(handler.one_variable, _find_method(server, 'GET', '/aaa/x'))
+        self.assertEqual(handler.two_variables, _find_method(server, 'GET', '/aaa/x/ccc/y'))
+        self.assertEqual(handler.two_variables, _find_method(server, 'PUT', '/aaa/x/ccc/y'))
+        self.assertEqual(handler.any_pattern, _find_method(server, 'GET', '/any/x/y'))
+
+        self.assertEqual(handler.literal_pattern, _find_method(server, 'GET', '/literal-pattern'))
+        self.assertEqual(handler.literal_variable, _find_method(server, 'GET', '/literal-variable'))
+
+        self.assertIsNone(_find_method(server, 'PUT', '/static'))
+        self.assertIsNone(_find_method(server, 'PUT', '/aaa/x'))
+        self.assertIsNone(_find_method(server, 'GET', '/aaa/x/ccc'))
+        self.assertIsNone(_find_method(server, 'DELETE', '/any/x'))
+
+    def test_static_and_class_methods(self):
+        handler = DescriptorsHandler()
+        server = HttpServer()
+        server.add_handler(handler)
+
+        self.assertEqual(handler.static_method, _find_method(server, 'GET', '/static-method'))
+        self.assertEqual(handler.class_method, _find_method(server, 'GET', '/class-method'))
+
+        for path in ('/static-method', '/class-method'):
+            request = _request('GET', path)
+            (_, _, binders), uri_variables = server._find_route(request)
+            self.assertEqual([request.headers], _convert_params(request, binders, uri_variables))
+
+    def test_uncombinable_routes(self):
+        handler = UncombinableRoutesHandler()
+        server = HttpServer()
+        server.add_handler(handler)
+
+        self.assertEqual(handler.backref, _find_method(server, 'GET', '/dup/abc/abc'))
+        self.assertIsNone(_find_method(server, 'GET', '/dup/abc/abd'))
+        self.assertEqual(handler.global_flags, _find_method(server, 'GET', '/FOO/bar'))
+        self.assertEqual(handler.conditional, _find_method(server, 'GET', '/axy'))
+        self.assertEqual(handler.conditional, _find_method(server, 'GET', '/az'))
+        self.assertIsNone(_find_method(server, 'GET', '/axz'))
+
+        # the routes are still matched in registration order
+        self.assertEqual(handler.global_flags, _find_method(server, 'GET', '/foo/x'))
+        self.assertEqual(5, len(server._regex_dispatch['GET']))
+
+        mapping, uri_variables = server._find_route(_request('GET', '/named/ab'))
+        self.assertEqual(handler.named_conditional, mapping[1])
+        self.assertEqual({'x': 'a'}, uri_variables)
+
+    def test_literal_patterns_as_static_routes(self):
+        handler = RoutesHandler()
+        server = HttpServer()
+        server.add_handler(handler)
+
+        self.assertIn('/anchored-pattern', server._static_routes['GET'])
+        self.assertIn('/literal-variable', server._static_routes['GET'])
+        self.assertEqual(5, len(server._regex_routes['GET']))
+
+        # patterns without the trailing $ are still prefix matches
+        self.assertNotIn('/literal-pattern', server._static_routes['GET'])
+        self.assertEqual(handler.literal_pattern, _find_method(server, 'GET', '/literal-pattern/x'))
+        self.assertEqual(handler.literal_pattern, _find_method(server, 'GET', '/literal-patternx'))
+        self.assertEqual(handler.anchored_pattern, _find_method(server, 'GET', '/anchored-pattern'))
+        self.assertIsNone(_find_method(server, 'GET', '/anchored-pattern/x'))
+
+        # literal patterns matched by a previous regex route keep the registration order
+        self.assertNotIn('/any/shadowed', server._static_routes['GET'])
+        self.assertEqual(handler.any_pattern, _find_method(server, 'GET', '/any/shadowed'))
+
+    def test_convert_params(self):
+        server = HttpServer()
+        server.add_handler(RoutesHandler())
+
+        request = _request('GET', '/aaa/x')
+        (_, _, binders), uri_variables = server._find_route(request)
+        self.assertEqual([{'bbb': 'x'}], _convert_params(request, binders, uri_variables))
+
+        request = _request('GET', '/aaa/x/ccc/y')
+        (_, _, binders), uri_variables = server._find_route(request)
+        self.assertEqual([{'bbb': 'x', 'ddd': 'y'}], _convert_params(request, binders, uri_variables))
+
+        request = _request('GET', '/static')
+        (_, _, binders), uri_variables = server._find_route(request)
+        self.assertEqual([], _convert_params(request, binders, uri_variables))
+
+        request = _request('POST', '/body')
+        request.body = b'{"a": [1, 2]}'
+        (_, _, binders), uri_variables = server._find_route(request)
+        self.assertEqual([b'{"a": [1, 2]}', {'a': [1, 2]}, {}], _convert_params(request, binders, uri_variables))
+
+        request = _request('GET', '/literal-variable')
+        (_, _, binders), uri_variables = server._find_route(request)
+        self.assertEqual([{}], _convert_params(request, binders, uri_variables))
+
+    @unittest.skipIf(importlib.util.find_spec('uvloop') is None, 'uvloop is not installed')
+    def test_use_uvloop(self):
+        try:
+            HttpServer(use_uvloop=True)
+            loop = asyncio.new_event_loop()
+            self.assertEqual('uvloop', type(loop).__module__.split('.')[0])
+            loop.close()
+        finally:
+            asyncio.set_event_loop_policy(None)
+
+    def test_handler_overrides(self):
+        handler = OverridingHandler()
+        server = HttpServer()
+        server.add_handler(handler)
+
+        self.assertEqual(handler.static, _find_method(server, 'GET', '/static-override'))
+        self.assertEqual(handler.one_variable, _find_method(server, 'GET', '/aaa/x'))
+        self.assertIsNone(_find_method(server, 'GET', '/static'))
+        self.assertIsNone(_find_method(server, 'GET', '/any/x'))
+
+
+Point = namedtuple('Point', ('x', 'y'))
+
+
+class PipelineHandler:
+    @uri_variable_mapping('/sleep/{ms}')
+    async def sleep(self, uri_variables):
+        await asyncio.sleep(int(uri_variables['ms']) / 1000)
+        return uri_variables
+
+    @uri_mapping('/file')
+    def file(self, query_params):
+        return HttpResponse(200, file_path=query_params['path'][0])
+
+    def __init__(self):
+        self.state = 0
+
+    @uri_mapping('/set', method='POST')
+    async def set_state(self, raw_body):
+        await asyncio.sleep(0.1)
+        self.state = int(raw_body)
+
+    @uri_mapping('/get')
+    def get_state(self):
+        return self.state
+
+    @uri_mapping('/point')
+    def point(self):
+        return {'point': Point(1, 2), 'big': 2 ** 64}
+
+    @uri_mapping('/echo', method='POST')
+    def echo(self, raw_body):
+        return HttpResponse(200, body=raw_body)
+
+
+class TestHttpServerConnection(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = HttpServer()
+        self.server.set_http_debug_enabled(False)
+        self.server.add_handler(PipelineHandler())
+        await self.server.start('127.0.0.1', 0)
+        port = self.server._server.sockets[0].getsockname()[1]
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.server.close()
+
+    async def _read_response(self) -> tuple:
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        status_line = head[:head.find(b'\r\n')]
+        for line in head.split(b'\r\n'):
+            if line.startswith(b'content-length:'):
+                return status_line, await self.reader.readexactly(int(line[15:]))
+        return status_line, b''
+
+    async def _read_response_body(self) -> bytes:
+        _, body = await self._read_response()
+        return body
+
+    async def test_file_response(self):
+        self.writer.write(f'GET /file?path={__file__} HTTP/1.1\r\n\r\n'.encode())
+        self.writer.write(b'GET /file?path=/not/existing/file HTTP/1.1\r\n\r\n')
+        self.writer.write(f'GET /file?path={__file__} HTTP/1.1\r\n\r\n'.encode())
+        with open(__file__, 'rb') as fd:
+            data = fd.read()
+        self.assertEqual((b'HTTP/1.1 200 OK', data), await self._read_response())
+        self.assertEqual((b'HTTP/1.1 500 Internal Server Error', b''), await self._read_response())
+        self.assertEqual((b'HTTP/1.1 200 OK', data), await self._read_response())
+
+    async def test_json_response(self):
+        self.writer.write(b'GET /point HTTP/1.1\r\n\r\n')
+        self.assertEqual((b'HTTP/1.1 200 OK', b'{"point": [1, 2], "big": 18446744073709551616}'),
+                         await self._read_response())
+
+    async def test_large_body(self):
+        body = bytes(range(256)) * 4096
+        self.writer.write(f'POST /echo HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n'.encode())
+        self.writer.write(body)
+        self.assertEqual(body, await self._read_response_body())
+
+    async def test_slow_handler_is_not_idle_time(self):
+        self.server.read_timeout = 0.3
+        self.writer.write(b'GET /sleep/600 HTTP/1.1\r\n\r\n')
+        self.assertIn(b'"600"', await self._read_response_body())
+        # the connection is still open after a handler slower than the read timeout
+        self.writer.write(b'GET /sleep/0 HTTP/1.1\r\n\r\n')
+        self.assertIn(b'"0"', await self._read_response_body())
+
+    async def test_pipelined_requests(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        self.writer.write(b'GET /sleep/300 HTTP/1.1\r\n\r\n'
+                          b'GET /sleep/200 HTTP/1.1\r\n\r\n'
+                          b'GET /sleep/100 HTTP/1.1\r\n\r\n'
+                          b'GET /not-found HTTP/1.1\r\n\r\n')
+        self.assertIn(b'"300"', await self._read_response_body())
+        self.assertIn(b'"200"', await self._read_response_body())
+        self.assertIn(b'"100"', await self._read_response_body())
+        self.assertEqual(b'', await self._read_response_body())
+        # the requests are executed concurrently
+        self.assertLess(loop.time() - start, 0.5)
+
+    async def test_pipelined_non_safe_requests(self):
+        self.writer.write(b'GET /get HTTP/1.1\r\n\r\n'
+                          b'POST /set HTTP/1.1\r\nContent-Length: 1\r\n\r\n1'
+                          b'GET /get HTTP/1.1\r\n\r\n'
+                          b'POST /set HTTP/1.1\r\nContent-Length: 1\r\n\r\n2'
+                          b'GET /get HTTP/1.1\r\n\r\n')
+        # the requests after a non-safe one see its effects
+        self.assertEqual(b'0', await self._read_response_body())
+        self.assertEqual(b'', await self._read_response_body())
+        self.assertEqual(b'1', await self._read_response_body())
+        self.assertEqual(b'', await self._read_response_body())
+        self.assertEqual(b'2', await self._read_response_body())
+
+
+if __name__ == '__main__':
+    unittest.main()